@@ -1,13 +1,21 @@
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, g, request, redirect, Response
 from flask_cors import CORS
-import validators
+import orjson
 import os
-import string
-import random
+import re
+import secrets
+import threading
+import time
+from cachetools import TTLCache
+from collections import Counter
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from functools import lru_cache
+from urllib.parse import urlparse
+import redis
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
+from middleware import LoggingMiddleware
 
 # Load environment variables
 load_dotenv()
@@ -19,204 +27,397 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', os.urandom(24))
 
 # MongoDB setup
 mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-client = MongoClient(mongo_uri, connectTimeoutMS=30000, serverSelectionTimeoutMS=30000)
-db = client.url_shortener
-urls_collection = db.urls
 
-# Create indexes
-urls_collection.create_index('short_code', unique=True)
-urls_collection.create_index('original_url')
-urls_collection.create_index('expires_at')
+@lru_cache(maxsize=1)
+def get_client(uri, connect_timeout_ms, server_selection_timeout_ms):
+    """Create the MongoClient once per process and reuse its pool"""
+    return MongoClient(
+        uri,
+        connectTimeoutMS=connect_timeout_ms,
+        serverSelectionTimeoutMS=server_selection_timeout_ms,
+        maxPoolSize=100,
+        minPoolSize=10,
+        waitQueueTimeoutMS=2000
+    )
+
+def get_urls():
+    """Return the urls collection from the cached client"""
+    return get_client(mongo_uri, 30000, 30000).url_shortener.urls
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """Create the Redis client once per process"""
+    redis_uri = os.getenv('REDIS_URI', 'redis://localhost:6379/0')
+    return redis.Redis.from_url(redis_uri, decode_responses=True)
+
+@lru_cache(maxsize=1)
+def ensure_indexes():
+    """Create indexes once per process instead of on every reload"""
+    urls = get_urls()
+    urls.create_index('short_code', unique=True)
+    # Covers the {short_code, expires_at: $gt} availability query so Mongo
+    # can answer it from the index alone
+    urls.create_index([('short_code', 1), ('expires_at', 1)])
+    urls.create_index('original_url')
+    # TTL index: Mongo's expiry monitor deletes expired docs itself, so no
+    # application-level cleanup job is needed. Pre-TTL deployments have a
+    # plain expires_at index under the same name with different options,
+    # which create_index rejects (IndexOptionsConflict) — drop it first
+    existing = urls.index_information().get('expires_at_1')
+    if existing is not None and 'expireAfterSeconds' not in existing:
+        urls.drop_index('expires_at_1')
+    urls.create_index('expires_at', expireAfterSeconds=0)
+    return True
+
+ensure_indexes()
+
+# In-process tier ahead of Redis for the hottest codes; entries are
+# (original_url, expires_at_epoch) and live at most 60 s
+_url_cache = TTLCache(maxsize=10000, ttl=60)
+_url_cache_lock = threading.Lock()
+
+_EPOCH = datetime(1970, 1, 1)
+
+def cache_url_mapping(short_code, original_url, expires_epoch):
+    with _url_cache_lock:
+        _url_cache[short_code] = (original_url, expires_epoch)
+
+def lookup_cached_url(short_code):
+    """Return the locally cached original URL, re-checking expiry in-process"""
+    with _url_cache_lock:
+        hit = _url_cache.get(short_code)
+    if hit and hit[1] > time.time():
+        return hit[0]
+    return None
+
+# Paths that look like a bare short code: /<1-20 url-safe chars>
+_SHORT_CODE_PATH_RE = re.compile(r'^/[A-Za-z0-9_-]{1,20}$')
+
+class FastRedirect:
+    """Short-circuits GET /<code> at the WSGI layer on a Redis cache hit.
+
+    Cache hits emit a raw 302 without touching Flask's routing, CORS or
+    response machinery; misses and every other path fall through to the
+    full app.
+    """
 
-# Custom Logging Middleware
-class LoggingMiddleware:
     def __init__(self, app):
         self.app = app
 
     def __call__(self, environ, start_response):
-        # Log request details
-        request_method = environ.get('REQUEST_METHOD')
-        path_info = environ.get('PATH_INFO')
-        query_string = environ.get('QUERY_STRING')
-        
-        print(f"[{datetime.utcnow().isoformat()}] {request_method} {path_info}?{query_string}")
-        
-        # Call the actual app
+        if environ.get('REQUEST_METHOD') == 'GET':
+            path = environ.get('PATH_INFO', '')
+            if _SHORT_CODE_PATH_RE.match(path):
+                code = path[1:]
+                target = lookup_cached_url(code)
+                if target is None:
+                    # One pipelined round-trip for the URL and its remaining
+                    # TTL, so the local tier learns the real expiry
+                    try:
+                        with get_redis().pipeline() as pipe:
+                            pipe.get(f"u:{code}")
+                            pipe.ttl(f"u:{code}")
+                            target, ttl = pipe.execute()
+                    except redis.RedisError:
+                        target = None
+                    if target and ttl and ttl > 0:
+                        cache_url_mapping(code, target, time.time() + ttl)
+                if target:
+                    record_visit(code)
+                    start_response('302 FOUND', [
+                        ('Location', target),
+                        ('Content-Length', '0')
+                    ])
+                    return [b'']
+                # Tell the Flask handler both tiers already missed so it
+                # does not probe them again
+                environ['shortener.cache_miss'] = True
         return self.app(environ, start_response)
 
-# Apply logging middleware
-app.wsgi_app = LoggingMiddleware(app.wsgi_app)
+# Apply middleware: cached redirects short-circuit; request logging can be
+# disabled entirely in production with LOG_REQUESTS=0
+app.wsgi_app = FastRedirect(app.wsgi_app)
+if os.getenv('LOG_REQUESTS', '1') == '1':
+    # Guard against double-wrapping on hot reload
+    assert not isinstance(app.wsgi_app, LoggingMiddleware)
+    app.wsgi_app = LoggingMiddleware(app.wsgi_app)
+
+def json_response(obj, status=200):
+    """Serialize a response with orjson, which formats datetimes natively"""
+    return Response(orjson.dumps(obj, default=str), status=status, mimetype='application/json')
 
 def generate_short_code(length=6):
     """Generate a random short code"""
-    chars = string.ascii_letters + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+    # One C-level call for base64url entropy instead of a per-char Python loop
+    return secrets.token_urlsafe(max(6, length))[:length]
+
+# Only allow letters, numbers, and hyphens/underscores (max 20 chars)
+_VALID_CODE_RE = re.compile(r'^[A-Za-z0-9_-]{1,20}\Z')
+
+_ALLOWED_SCHEMES = {'http', 'https'}
 
 def is_valid_custom_code(code):
     """Validate custom short code"""
-    if not code:
-        return False
-    if len(code) > 20:
-        return False
-    # Only allow letters, numbers, and hyphens/underscores
-    return all(c.isalnum() or c in ('-', '_') for c in code)
+    return bool(code) and _VALID_CODE_RE.match(code) is not None
+
+@app.before_request
+def _stamp_request_time():
+    # One utcnow() per request; handlers read g.now for a consistent 'now'
+    g.now = datetime.utcnow()
 
 @app.route('/api/shorten', methods=['POST'])
 def shorten_url():
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 400
-        
-    data = request.get_json()
+    # Parse the body directly; skips the is_json header walk and stdlib
+    # json.loads, and cache=False keeps the raw bytes off the request object
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return json_response({'error': 'Request must be JSON'}, 400)
     original_url = data.get('url', '').strip()
     custom_code = data.get('custom_code', '').strip()
     validity = int(data.get('validity', 30))  # Default to 30 minutes
     
     if not original_url:
-        return jsonify({'error': 'URL is required'}), 400
+        return json_response({'error': 'URL is required'}, 400)
     
-    if not validators.url(original_url):
-        return jsonify({'error': 'Invalid URL format'}), 400
+    # Cheap scheme + host check; full validators.url() was pure-Python
+    # overhead on the hot write path
+    parsed = urlparse(original_url)
+    if parsed.scheme not in _ALLOWED_SCHEMES or not parsed.netloc:
+        return json_response({'error': 'Invalid URL format'}, 400)
     
     # Calculate expiration time
-    expires_at = datetime.utcnow() + timedelta(minutes=validity)
+    expires_at = g.now + timedelta(minutes=validity)
     
     # Handle custom code if provided
-    if custom_code:
-        if not is_valid_custom_code(custom_code):
-            return jsonify({
-                'error': 'Custom code can only contain letters, numbers, hyphens and underscores (max 20 chars)'
-            }), 400
-        
-        # Check if custom code already exists
-        existing = urls_collection.find_one({'short_code': custom_code})
-        if existing:
-            return jsonify({
-                'error': 'This custom URL is already taken'
-            }), 400
-        
-        short_code = custom_code
-    else:
-        # Generate random code if no custom code provided
-        short_code = generate_short_code()
-        while urls_collection.find_one({'short_code': short_code}):
+    if custom_code and not is_valid_custom_code(custom_code):
+        return json_response({
+            'error': 'Custom code can only contain letters, numbers, hyphens and underscores (max 20 chars)'
+        }, 400)
+
+    # Insert new record, letting the unique index on short_code reject
+    # duplicates instead of paying for a find_one pre-check
+    short_code = custom_code or generate_short_code()
+    for attempt in range(5):
+        try:
+            get_urls().insert_one({
+                'original_url': original_url,
+                'short_code': short_code,
+                'visits': 0,
+                'created_at': g.now,
+                'last_accessed': None,
+                'expires_at': expires_at,
+                'is_custom': bool(custom_code),
+                'validity_minutes': validity
+            })
+            break
+        except DuplicateKeyError:
+            if custom_code:
+                return json_response({
+                    'error': 'This custom URL is already taken'
+                }, 400)
+            # Random code collided, try a fresh one
             short_code = generate_short_code()
-    
-    # Insert new record
-    urls_collection.insert_one({
+    else:
+        return json_response({'error': 'Could not generate a unique short code'}, 500)
+
+    # Drop any stale local entry for a code that was expired and re-registered
+    with _url_cache_lock:
+        _url_cache.pop(short_code, None)
+
+
+    return json_response({
         'original_url': original_url,
+        'short_url': request.host_url + short_code,
         'short_code': short_code,
-        'visits': 0,
-        'created_at': datetime.utcnow(),
-        'last_accessed': None,
         'expires_at': expires_at,
-        'is_custom': bool(custom_code),
-        'validity_minutes': validity
-    })
-    
-    return jsonify({
-        'original_url': original_url,
-        'short_url': f"{request.host_url}{short_code}",
-        'short_code': short_code,
-        'expires_at': expires_at.isoformat(),
         'status': 'created',
         'is_custom': bool(custom_code)
     })
 
+# Visit bumps are coalesced in memory and flushed in batches, keeping the
+# redirect path free of any per-request write
+_visit_buf = Counter()
+_visit_lock = threading.Lock()
+
+def record_visit(short_code):
+    """Buffer a visit bump; applied in batches by flush_visit_buffer"""
+    # Threads do not survive fork(), so under gunicorn's preload_app the
+    # flusher must be (re)started in the worker, not the master
+    if _flush_thread_pid != os.getpid():
+        _ensure_flush_thread()
+    with _visit_lock:
+        _visit_buf[short_code] += 1
+
 @app.route('/<short_code>')
 def redirect_to_original(short_code):
     """Redirect short URL to original URL"""
-    url = urls_collection.find_one_and_update(
-        {'short_code': short_code},
-        {'$inc': {'visits': 1}, '$set': {'last_accessed': datetime.utcnow()}},
-        return_document=True
-    )
-    
+    # Serve hot codes from the in-process tier, then the Redis cache —
+    # unless FastRedirect already probed both for this request
+    if request.environ.get('shortener.cache_miss'):
+        cached = None
+    else:
+        cached = lookup_cached_url(short_code)
+        if cached is None:
+            try:
+                cached = get_redis().get(f"u:{short_code}")
+            except redis.RedisError:
+                cached = None
+
+    if cached:
+        record_visit(short_code)
+        return redirect(cached, code=302)
+
+    url = get_urls().find_one({'short_code': short_code})
+
     if not url:
-        return jsonify({'error': 'URL not found'}), 404
-    
-    if url.get('expires_at') and url['expires_at'] < datetime.utcnow():
-        return jsonify({'error': 'URL has expired'}), 410
-    
+        return json_response({'error': 'URL not found'}, 404)
+
+    now = g.now
+    if url.get('expires_at') and url['expires_at'] < now:
+        return json_response({'error': 'URL has expired'}, 410)
+
+    # Cache the mapping for the URL's remaining validity, in both tiers
+    if url.get('expires_at'):
+        ttl = int((url['expires_at'] - now).total_seconds())
+        if ttl > 0:
+            cache_url_mapping(short_code, url['original_url'],
+                              (url['expires_at'] - _EPOCH).total_seconds())
+            try:
+                get_redis().set(f"u:{short_code}", url['original_url'], ex=ttl)
+            except redis.RedisError:
+                pass
+
+    record_visit(short_code)
     return redirect(url['original_url'], code=302)
 
 @app.route('/api/url/<short_code>', methods=['GET'])
 def get_original_url(short_code):
-    url = urls_collection.find_one({'short_code': short_code})
+    url = get_urls().find_one({'short_code': short_code})
     
     if not url:
-        return jsonify({'error': 'URL not found'}), 404
+        return json_response({'error': 'URL not found'}, 404)
     
-    if url.get('expires_at') and url['expires_at'] < datetime.utcnow():
-        return jsonify({'error': 'URL has expired'}), 410
+    if url.get('expires_at') and url['expires_at'] < g.now:
+        return json_response({'error': 'URL has expired'}, 410)
     
-    return jsonify({
+    return json_response({
         'original_url': url['original_url'],
         'short_code': url['short_code'],
-        'expires_at': url['expires_at'].isoformat() if url.get('expires_at') else None,
+        'expires_at': url.get('expires_at'),
         'visits': url['visits']
     })
 
 @app.route('/api/stats/<short_code>', methods=['GET'])
 def get_url_stats(short_code):
-    url = urls_collection.find_one({'short_code': short_code})
+    url = get_urls().find_one({'short_code': short_code})
     
     if not url:
-        return jsonify({'error': 'URL not found'}), 404
+        return json_response({'error': 'URL not found'}, 404)
     
-    return jsonify({
+    return json_response({
         'original_url': url['original_url'],
         'short_code': url['short_code'],
         'visits': url['visits'],
-        'created_at': url['created_at'].isoformat(),
-        'last_accessed': url.get('last_accessed', '').isoformat() if url.get('last_accessed') else None,
-        'expires_at': url.get('expires_at', '').isoformat() if url.get('expires_at') else None,
+        'created_at': url['created_at'],
+        'last_accessed': url.get('last_accessed'),
+        'expires_at': url.get('expires_at'),
         'is_custom': url.get('is_custom', False),
         'validity_minutes': url.get('validity_minutes', 30)
     })
 
 @app.route('/api/recent', methods=['GET'])
 def recent_urls():
-    recent = urls_collection.find({
-        'expires_at': {'$gt': datetime.utcnow()}  # Only show non-expired URLs
-    }).sort('created_at', -1).limit(5)
-    
-    return jsonify([{
+    # Sort by _id: ObjectIds encode creation time, so this matches the
+    # created_at ordering while scanning only the primary index
+    recent = get_urls().find(
+        {'expires_at': {'$gt': g.now}},  # Only show non-expired URLs
+        projection={
+            'original_url': 1, 'short_code': 1, 'visits': 1,
+            'last_accessed': 1, 'expires_at': 1, 'is_custom': 1
+        }
+    ).sort('_id', -1).limit(5).batch_size(5)
+
+    host = request.host_url
+    payload = [{
         'original_url': u['original_url'],
-        'short_url': f"{request.host_url}{u['short_code']}",
+        'short_url': host + u['short_code'],
         'short_code': u['short_code'],
         'visits': u['visits'],
-        'created_at': u['created_at'].isoformat(),
-        'last_accessed': u.get('last_accessed', '').isoformat() if u.get('last_accessed') else None,
-        'expires_at': u.get('expires_at', '').isoformat() if u.get('expires_at') else None,
+        # generation_time is tz-aware; strip it so created_at serializes
+        # like every other (naive UTC) datetime in the API
+        'created_at': u['_id'].generation_time.replace(tzinfo=None),
+        'last_accessed': u.get('last_accessed'),
+        'expires_at': u.get('expires_at'),
         'is_custom': u.get('is_custom', False)
-    } for u in recent])
+    } for u in recent]
+
+    return json_response(payload)
 
 @app.route('/api/check-code/<short_code>', methods=['GET'])
 def check_code_availability(short_code):
     if not is_valid_custom_code(short_code):
-        return jsonify({
+        return json_response({
             'available': False,
             'message': 'Invalid code format. Only letters, numbers, hyphens and underscores are allowed (max 20 chars)'
         })
     
-    existing = urls_collection.find_one({
+    existing = get_urls().find_one({
         'short_code': short_code,
-        'expires_at': {'$gt': datetime.utcnow()}  # Only check non-expired URLs
+        'expires_at': {'$gt': g.now}  # Only check non-expired URLs
     })
     
-    return jsonify({
+    return json_response({
         'available': not existing,
         'message': 'Code already in use' if existing else 'Code available'
     })
 
-# Background cleanup task for expired URLs
-def cleanup_expired_urls():
-    result = urls_collection.delete_many({'expires_at': {'$lt': datetime.utcnow()}})
-    print(f"Cleaned up {result.deleted_count} expired URLs")
+# Batch-apply buffered visit bumps with a single bulk_write
+def flush_visit_buffer():
+    with _visit_lock:
+        if not _visit_buf:
+            return
+        snapshot = dict(_visit_buf)
+        _visit_buf.clear()
+
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {'short_code': code},
+            {'$inc': {'visits': count}, '$set': {'last_accessed': now}}
+        )
+        for code, count in snapshot.items()
+    ]
+    try:
+        get_urls().bulk_write(ops, ordered=False)
+    except PyMongoError:
+        # Merge the counts back so the next tick actually retries them
+        with _visit_lock:
+            _visit_buf.update(snapshot)
+        raise
+
+VISIT_FLUSH_INTERVAL = int(os.getenv('VISIT_FLUSH_INTERVAL', 5))
+
+def _visit_flush_loop():
+    while True:
+        time.sleep(VISIT_FLUSH_INTERVAL)
+        try:
+            flush_visit_buffer()
+        except PyMongoError:
+            pass  # keep the thread alive; the buffer is retried next tick
+
+# The visit buffer lives in this process, so its flusher must too; a plain
+# daemon thread replaces the APScheduler job, started lazily per process
+_flush_thread_pid = None
+_flush_thread_lock = threading.Lock()
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(cleanup_expired_urls, 'interval', minutes=30)
-scheduler.start()
+def _ensure_flush_thread():
+    global _flush_thread_pid
+    with _flush_thread_lock:
+        if _flush_thread_pid != os.getpid():
+            _flush_thread_pid = os.getpid()
+            threading.Thread(target=_visit_flush_loop, daemon=True).start()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Dev server only; production runs `gunicorn -c gunicorn.conf.py app:app`
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_ENV', 'development') == 'development')
\ No newline at end of file
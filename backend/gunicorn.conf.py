@@ -0,0 +1,15 @@
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count() * 2 + 1
+threads = 4
+worker_class = 'gthread'
+preload_app = True
+worker_tmp_dir = '/dev/shm'
+
+def post_fork(server, worker):
+    # MongoClient (and the Redis client) are only fork-safe if created after
+    # the fork; clear the cached factories so each worker builds its own
+    from app import get_client, get_redis
+    get_client.cache_clear()
+    get_redis.cache_clear()
@@ -0,0 +1,73 @@
+import io
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+class LoggingMiddleware:
+    """Logs requests through a bounded queue drained by a background thread.
+
+    The request path only captures the raw request values and does a
+    non-blocking put; the writer thread formats the line, batches into a
+    64 KB buffer and flushes either when 32 KB have accumulated or every
+    200 ms, so no write() syscall happens per request. Lines are dropped
+    instead of blocking when the queue is full.
+    """
+
+    _BUFFER_SIZE = 65536
+    _FLUSH_THRESHOLD = 32768
+    _FLUSH_INTERVAL = 0.2
+
+    def __init__(self, app):
+        self.app = app
+        self._q = queue.Queue(maxsize=10000)
+        self._writer_lock = threading.Lock()
+        self._writer_pid = None
+
+    def _ensure_writer(self):
+        # Threads do not survive fork(); with gunicorn's preload_app the
+        # writer started in the master would not exist in the workers, so
+        # each process starts its own on first request
+        with self._writer_lock:
+            if self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                threading.Thread(target=self._drain, daemon=True).start()
+
+    def _drain(self):
+        out = io.BufferedWriter(sys.stdout.buffer, buffer_size=self._BUFFER_SIZE)
+        pending = 0
+        while True:
+            try:
+                line = self._q.get(timeout=self._FLUSH_INTERVAL)
+            except queue.Empty:
+                if pending:
+                    out.flush()
+                    pending = 0
+                continue
+            ts, method, path, query = line
+            data = ('[%s] %s %s?%s\n' % (ts.isoformat(), method, path, query)).encode('utf-8', 'replace')
+            out.write(data)
+            pending += len(data)
+            if pending >= self._FLUSH_THRESHOLD:
+                out.flush()
+                pending = 0
+
+    def __call__(self, environ, start_response):
+        if self._writer_pid != os.getpid():
+            self._ensure_writer()
+
+        # Capture raw values only; the writer thread does the formatting
+        _get = environ.get
+        try:
+            self._q.put_nowait((
+                datetime.utcnow(),
+                _get('REQUEST_METHOD'),
+                _get('PATH_INFO'),
+                _get('QUERY_STRING'),
+            ))
+        except queue.Full:
+            pass  # drop rather than block the request on a slow consumer
+
+        # Call the actual app
+        return self.app(environ, start_response)